@@ -1,12 +1,20 @@
 """bareASGI auth server"""
 
+from .auth_cache import AuthCache
 from .auth_controller import AuthController
 from .auth_service import AuthService
+from .client_token_cache import ClientTokenCache
+from .known_users import KnownUsers
+from .token_encoder import TokenEncoder
 from .types import UserNotFoundError, UserInvalidError, UserCredentialsError
 
 __all__ = [
+    'AuthCache',
     'AuthController',
     'AuthService',
+    'ClientTokenCache',
+    'KnownUsers',
+    'TokenEncoder',
     'UserNotFoundError',
     'UserInvalidError',
     'UserCredentialsError'
@@ -0,0 +1,370 @@
+"""Authentication Cache
+"""
+
+from datetime import timedelta
+import fcntl
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import time
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+LOGGER = logging.getLogger(__name__)
+
+# The snapshot starts with a header of the magic bytes, the entry count and
+# the length of the revocations. This is followed by an index of fixed size
+# records holding the hash of the user identifier and the position of its
+# entry, sorted by hash. Then come the revocations, as a JSON object mapping
+# user identifiers to when their sessions were revoked and when the revocation
+# expires, and the entries, as JSON arrays of the user identifier, expiry,
+# validity and authorizations.
+SNAPSHOT_MAGIC = b'BAC2'
+HEADER = struct.Struct('<4sII')
+INDEX_RECORD = struct.Struct('<QII')
+
+UserState = Tuple[bool, List[str]]
+CacheEntry = Tuple[float, bool, List[str]]
+# When the sessions were revoked in seconds, and when the revocation expires.
+Revocation = Tuple[int, float]
+
+
+def _hash_user_id(user_id: str) -> int:
+    digest = hashlib.blake2b(user_id.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def _open_snapshot(path: str) -> Optional[Tuple[mmap.mmap, int, int]]:
+    try:
+        with open(path, 'rb') as file_ptr:
+            if os.fstat(file_ptr.fileno()).st_size < HEADER.size:
+                return None
+            snapshot = mmap.mmap(file_ptr.fileno(), 0, access=mmap.ACCESS_READ)
+    except FileNotFoundError:
+        LOGGER.debug('No snapshot found at "%s"', path)
+        return None
+
+    magic, count, revocations_length = HEADER.unpack_from(snapshot, 0)
+    if (
+            magic != SNAPSHOT_MAGIC or
+            len(snapshot) <
+            HEADER.size + count * INDEX_RECORD.size + revocations_length
+    ):
+        LOGGER.warning('Ignoring invalid snapshot "%s"', path)
+        snapshot.close()
+        return None
+
+    return snapshot, count, revocations_length
+
+
+def _read_entry(
+        snapshot: mmap.mmap,
+        position: int
+) -> Tuple[int, str, CacheEntry]:
+    key, offset, length = INDEX_RECORD.unpack_from(
+        snapshot,
+        HEADER.size + position * INDEX_RECORD.size
+    )
+    user_id, expires, is_valid, authorizations = json.loads(
+        snapshot[offset:offset + length]
+    )
+    return key, user_id, (expires, is_valid, authorizations)
+
+
+def _read_revocations(
+        snapshot: mmap.mmap,
+        count: int,
+        length: int
+) -> Iterator[Tuple[str, Revocation]]:
+    offset = HEADER.size + count * INDEX_RECORD.size
+    revocations = json.loads(snapshot[offset:offset + length])
+    for user_id, (revoked_at, expires) in revocations.items():
+        yield user_id, (revoked_at, expires)
+
+
+def _read_entries(
+        snapshot: mmap.mmap,
+        count: int
+) -> Iterator[Tuple[str, CacheEntry]]:
+    for position in range(count):
+        _key, user_id, entry = _read_entry(snapshot, position)
+        yield user_id, entry
+
+
+class AuthCache:
+    """A cache of the validity and authorizations of users.
+
+    The cache can be persisted to a snapshot file, so a restarted server does
+    not need to go to the auth service for every user it has recently seen.
+    The snapshot is memory-mapped and entries are decoded individually as they
+    are looked up. Expiry times are stored as wall clock timestamps, so entries
+    which expire while the server is down are discarded when they are read.
+
+    When several workers share a snapshot, each merges its entries with the
+    snapshot on disk while holding a lock, so the entries of every worker are
+    kept.
+
+    The snapshot also holds the session revocations, so they survive a
+    restart. These are read in full when the snapshot is loaded, and shared
+    by the workers only through the snapshot.
+    """
+
+    def __init__(
+            self,
+            ttl: timedelta,
+            snapshot_path: Optional[str] = None
+    ) -> None:
+        """Initialise the authentication cache.
+
+        Args:
+            ttl (timedelta): How long an entry remains valid.
+            snapshot_path (Optional[str], optional): The path of the snapshot
+                file. Defaults to None.
+        """
+        self.ttl = ttl
+        self.snapshot_path = snapshot_path
+        self.revocations: Dict[str, Revocation] = {}
+        self._entries: Dict[str, CacheEntry] = {}
+        self._discarded: Set[str] = set()
+        self._snapshot: Optional[mmap.mmap] = None
+        self._snapshot_count = 0
+
+    def get(self, user_id: str) -> Optional[UserState]:
+        """Get the cached state of a user.
+
+        Args:
+            user_id (str): The user identifier.
+
+        Returns:
+            Optional[UserState]: The validity and authorizations of the user if
+                cached and not expired; otherwise None.
+        """
+        entry = self._entries.get(user_id)
+        if entry is None and user_id not in self._discarded:
+            entry = self._find_in_snapshot(user_id)
+            if entry is not None:
+                self._entries[user_id] = entry
+        if entry is None:
+            return None
+
+        expires, is_valid, authorizations = entry
+        if expires <= time.time():
+            self.discard(user_id)
+            return None
+
+        return is_valid, authorizations
+
+    def set(
+            self,
+            user_id: str,
+            is_valid: bool,
+            authorizations: List[str]
+    ) -> None:
+        """Cache the state of a user.
+
+        Args:
+            user_id (str): The user identifier.
+            is_valid (bool): True if the user is valid.
+            authorizations (List[str]): The authorizations of the user.
+        """
+        expires = time.time() + self.ttl.total_seconds()
+        self._entries[user_id] = (expires, is_valid, authorizations)
+        self._discarded.discard(user_id)
+
+    def discard(self, user_id: str) -> None:
+        """Remove a user from the cache.
+
+        Args:
+            user_id (str): The user identifier.
+        """
+        self._entries.pop(user_id, None)
+        if self._snapshot is not None:
+            self._discarded.add(user_id)
+
+    def load(self) -> None:
+        """Map the snapshot file into memory.
+
+        Entries are not decoded until they are looked up. The unexpired
+        revocations are added to `revocations`.
+        """
+        if self.snapshot_path is None:
+            return
+
+        snapshot = _open_snapshot(self.snapshot_path)
+        if snapshot is None:
+            return
+
+        self._snapshot, self._snapshot_count, revocations_length = snapshot
+
+        now = time.time()
+        for user_id, revocation in _read_revocations(
+                self._snapshot,
+                self._snapshot_count,
+                revocations_length
+        ):
+            current = self.revocations.get(user_id)
+            if revocation[1] > now and (
+                    current is None or revocation[0] > current[0]
+            ):
+                self.revocations[user_id] = revocation
+
+        LOGGER.debug(
+            'Mapped snapshot "%s" of %d entries',
+            self.snapshot_path,
+            self._snapshot_count
+        )
+
+    def save(self) -> None:
+        """Merge the unexpired entries and revocations into the snapshot file.
+        """
+        if self.snapshot_path is None:
+            return
+
+        # The lock is held on a separate file, as the snapshot is replaced.
+        with open(self.snapshot_path + '.lock', 'ab') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                self._merge_and_write(self.snapshot_path)
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _merge_and_write(self, snapshot_path: str) -> None:
+        entries: Dict[str, CacheEntry] = {}
+        revocations: Dict[str, Revocation] = {}
+
+        def merge_revocation(user_id: str, revocation: Revocation) -> None:
+            # The latest revocation applies to the most sessions.
+            current = revocations.get(user_id)
+            if current is None or revocation[0] > current[0]:
+                revocations[user_id] = revocation
+
+        def merge(user_id: str, entry: CacheEntry) -> None:
+            # The latest entry has the latest expiry.
+            if user_id in self._discarded:
+                return
+            current = entries.get(user_id)
+            if current is None or entry[0] > current[0]:
+                entries[user_id] = entry
+
+        # Merge the snapshot saved by other workers since this one started.
+        current_snapshot = _open_snapshot(snapshot_path)
+        if current_snapshot is not None:
+            snapshot_map, count, revocations_length = current_snapshot
+            try:
+                for user_id, entry in _read_entries(snapshot_map, count):
+                    merge(user_id, entry)
+                for user_id, revocation in _read_revocations(
+                        snapshot_map,
+                        count,
+                        revocations_length
+                ):
+                    merge_revocation(user_id, revocation)
+            finally:
+                snapshot_map.close()
+        if self._snapshot is not None:
+            for user_id, entry in _read_entries(
+                    self._snapshot,
+                    self._snapshot_count
+            ):
+                merge(user_id, entry)
+        for user_id, entry in self._entries.items():
+            entries[user_id] = entry
+        for user_id, revocation in self.revocations.items():
+            merge_revocation(user_id, revocation)
+
+        now = time.time()
+        revocations_record = json.dumps(
+            {
+                user_id: revocation
+                for user_id, revocation in revocations.items()
+                if revocation[1] > now
+            },
+            separators=(',', ':')
+        ).encode('utf-8')
+        records = sorted(
+            (
+                _hash_user_id(user_id),
+                json.dumps(
+                    [user_id, expires, is_valid, authorizations],
+                    separators=(',', ':')
+                ).encode('utf-8')
+            )
+            for user_id, (expires, is_valid, authorizations) in entries.items()
+            if expires > now
+        )
+
+        index = bytearray()
+        offset = (
+            HEADER.size +
+            len(records) * INDEX_RECORD.size +
+            len(revocations_record)
+        )
+        for key, record in records:
+            index += INDEX_RECORD.pack(key, offset, len(record))
+            offset += len(record)
+
+        # Write to a temporary file which is then renamed, so an interrupted
+        # save leaves a complete snapshot.
+        directory = os.path.dirname(os.path.abspath(snapshot_path))
+        file_descriptor, temp_path = tempfile.mkstemp(
+            dir=directory,
+            prefix='.auth-cache-'
+        )
+        try:
+            with os.fdopen(file_descriptor, 'wb') as file_ptr:
+                file_ptr.write(
+                    HEADER.pack(
+                        SNAPSHOT_MAGIC,
+                        len(records),
+                        len(revocations_record)
+                    )
+                )
+                file_ptr.write(index)
+                file_ptr.write(revocations_record)
+                for _key, record in records:
+                    file_ptr.write(record)
+            os.replace(temp_path, snapshot_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+        LOGGER.info(
+            'Saved %d cache entries to "%s"',
+            len(records),
+            snapshot_path
+        )
+
+    def _find_in_snapshot(self, user_id: str) -> Optional[CacheEntry]:
+        if self._snapshot is None:
+            return None
+
+        key = _hash_user_id(user_id)
+
+        # Find the first index record with the key.
+        low, high = 0, self._snapshot_count
+        while low < high:
+            middle = (low + high) // 2
+            (middle_key, _, _) = INDEX_RECORD.unpack_from(
+                self._snapshot,
+                HEADER.size + middle * INDEX_RECORD.size
+            )
+            if middle_key < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        # Hashes may collide, so check the user identifiers.
+        for position in range(low, self._snapshot_count):
+            entry_key, entry_user_id, entry = _read_entry(
+                self._snapshot,
+                position
+            )
+            if entry_key != key:
+                break
+            if entry_user_id == user_id:
+                return entry
+
+        return None
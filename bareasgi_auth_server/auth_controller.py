@@ -1,10 +1,13 @@
 """Authentication Controller
 """
 
+import asyncio
+from calendar import timegm
 from datetime import datetime, timedelta
 import json
 import logging
-from typing import Dict, Optional
+import time
+from typing import Dict, List, Optional, Tuple
 from urllib.parse import parse_qsl, urlparse
 
 from bareasgi import (
@@ -12,7 +15,8 @@ from bareasgi import (
     text_reader,
     text_writer,
     HttpRequest,
-    HttpResponse
+    HttpResponse,
+    LifespanRequest
 )
 from bareutils import header, response_code
 from bareutils.cookies import make_cookie
@@ -25,14 +29,19 @@ from bareasgi_auth_common import (
 )
 import jwt
 
+from .auth_cache import AuthCache, Revocation, UserState
 from .auth_service import AuthService
+from .client_token_cache import ClientTokenCache, IssuedToken
+from .known_users import KnownUsers
+from .session_stream import RenewalScheduler, SessionStream
+from .token_encoder import TokenEncoder
 from .types import (
     BadRequestError,
     UserInvalidError,
     UserCredentialsError,
     UserNotFoundError
 )
-from .utils import JSONEncoderEx
+from .utils import JSONEncoderEx, is_etag_match, make_etag
 
 LOGGER = logging.getLogger(__name__)
 
@@ -44,7 +53,13 @@ class AuthController:
             self,
             path_prefix: str,
             token_manager: TokenManager,
-            auth_service: AuthService
+            auth_service: AuthService,
+            auth_cache: Optional[AuthCache] = None,
+            prewarm: bool = False,
+            client_token_cache: Optional[ClientTokenCache] = None,
+            stream_renewal_margin: Optional[timedelta] = None,
+            known_users: Optional[KnownUsers] = None,
+            stream_keepalive_interval: timedelta = timedelta(seconds=15)
     ) -> None:
         """Initialise the authentication controller.
 
@@ -52,10 +67,42 @@ class AuthController:
             path_prefix (str): The path prefix.
             authenticator (JwtAuthenticator): [description]
             auth_service (AuthService): [description]
+            auth_cache (Optional[AuthCache], optional): An optional cache of
+                user validity and authorizations. Defaults to None.
+            prewarm (bool, optional): If true the auth service is prepared
+                before the server accepts requests. Defaults to False.
+            client_token_cache (Optional[ClientTokenCache], optional): The
+                cache of tokens issued to machine clients. Defaults to a cache
+                which renews tokens in the last tenth of their lease.
+            stream_renewal_margin (Optional[timedelta], optional): If set, the
+                session stream route is added, and renewed tokens are pushed
+                this long before the current token expires. Defaults to None.
+            known_users (Optional[KnownUsers], optional): An optional filter
+                used to reject unknown users without calling the auth service.
+                Users created since it was last refreshed are rejected unless
+                they are added to it. Defaults to None.
+            stream_keepalive_interval (timedelta, optional): How long a
+                session stream may be idle before a comment is sent to keep
+                the connection open. Defaults to 15 seconds.
         """
         self.path_prefix = path_prefix
         self.token_manager = token_manager
+        self.token_encoder = TokenEncoder(token_manager)
         self.auth_service = auth_service
+        self.auth_cache = auth_cache
+        self.prewarm = prewarm
+        self.client_token_cache = client_token_cache or ClientTokenCache(
+            token_manager.lease_expiry / 10
+        )
+        self.stream_renewal_margin = stream_renewal_margin
+        self.renewal_scheduler = RenewalScheduler(self._renew_stream)
+        self.known_users = known_users
+        self.stream_keepalive_interval = stream_keepalive_interval
+        # The revocations are kept with the cache, so they are saved in its
+        # snapshot.
+        self._revocations: Dict[str, Revocation] = (
+            auth_cache.revocations if auth_cache is not None else {}
+        )
 
     def add_routes(self, app: Application) -> Application:
         """Add the routes that are handled by the controller.
@@ -77,6 +124,11 @@ class AuthController:
             self.path_prefix + '/authenticate',
             self.login
         )
+        app.http_router.add(
+            {'POST'},
+            self.path_prefix + '/token',
+            self.client_token
+        )
         app.http_router.add(
             {'POST', 'OPTIONS'},
             self.path_prefix + '/logout',
@@ -92,10 +144,122 @@ class AuthController:
             self.path_prefix + '/whoami',
             self.who_am_i
         )
+        if self.stream_renewal_margin is not None:
+            app.http_router.add(
+                {'GET'},
+                self.path_prefix + '/session/stream',
+                self.session_stream
+            )
+
+        app.startup_handlers.append(self.on_startup)
+        app.shutdown_handlers.append(self.on_shutdown)
 
         return app
 
-    async def _authenticate(self, request: HttpRequest) -> bytes:
+    async def on_startup(self, _request: LifespanRequest) -> None:
+        """Load the cache snapshot and prepare the auth service."""
+        if self.auth_cache is not None:
+            try:
+                self.auth_cache.load()
+            except Exception:  # pylint: disable=broad-except
+                LOGGER.exception('Failed to load the cache snapshot')
+        if self.prewarm:
+            LOGGER.debug('Preparing the auth service')
+            await self.auth_service.prepare()
+        if self.known_users is not None:
+            self.known_users.start()
+
+    async def on_shutdown(self, _request: LifespanRequest) -> None:
+        """Close the session streams and save the cache snapshot."""
+        if self.known_users is not None:
+            await self.known_users.stop()
+        await self.renewal_scheduler.close()
+        if self.auth_cache is not None:
+            try:
+                self.auth_cache.save()
+            except Exception:  # pylint: disable=broad-except
+                LOGGER.exception('Failed to save the cache snapshot')
+
+    def revoke(self, user_id: str) -> None:
+        """Revoke the sessions of a user.
+
+        Tokens issued to the user before the revocation can no longer be
+        renewed, so the user must authenticate again. Any cached state and
+        client tokens for the user are discarded, and the session streams of
+        the user are sent a revocation notice and closed.
+
+        Token times are in whole seconds, so a token issued in the same second
+        as the revocation is not revoked. This lets the user log in again
+        straight away.
+
+        Revocations are held by this process only. If there is an auth cache
+        with a snapshot they are saved in it at shutdown and loaded at
+        startup, so they survive a restart, but other workers do not see them
+        until they next load the snapshot.
+
+        Args:
+            user_id (str): The user identifier.
+        """
+        LOGGER.info('Revoking sessions for user "%s"', user_id)
+
+        now = time.time()
+        # Tokens older than the session expiry cannot be renewed anyway.
+        for revoked_user_id, (_revoked_at, expires) in list(
+                self._revocations.items()
+        ):
+            if expires <= now:
+                del self._revocations[revoked_user_id]
+        self._revocations[user_id] = (
+            int(now),
+            now + self.token_manager.session_expiry.total_seconds()
+        )
+
+        if self.auth_cache is not None:
+            self.auth_cache.discard(user_id)
+        self.client_token_cache.evict(user_id)
+        self.renewal_scheduler.notify(
+            user_id,
+            'revoked',
+            {'reason': 'session revoked'}
+        )
+
+    def _is_revoked(self, user_id: str, issued_at: datetime) -> bool:
+        revocation = self._revocations.get(user_id)
+        return (
+            revocation is not None and
+            timegm(issued_at.utctimetuple()) < revocation[0]
+        )
+
+    async def _user_state(self, user_id: str) -> UserState:
+        if self.auth_cache is not None:
+            user_state = self.auth_cache.get(user_id)
+            if user_state is not None:
+                LOGGER.debug('Using cached state for user "%s"', user_id)
+                return user_state
+
+        is_valid = await self.auth_service.is_valid_user(user_id)
+        authorizations = (
+            await self.auth_service.authorizations(user_id)
+            if is_valid
+            else []
+        )
+
+        if self.auth_cache is not None:
+            self.auth_cache.set(user_id, is_valid, authorizations)
+
+        return is_valid, authorizations
+
+    async def _authorizations(self, user_id: str) -> List[str]:
+        # A login always fetches the authorizations, refreshing the cache, so
+        # changes take effect when the user logs in again.
+        authorizations = await self.auth_service.authorizations(user_id)
+
+        if self.auth_cache is not None:
+            self.auth_cache.set(user_id, True, authorizations)
+
+        return authorizations
+
+    async def _read_credentials(self, request: HttpRequest) -> Dict[str, str]:
         content_type = header.content_type(request.scope['headers'])
         media_type = None if content_type is None else content_type[0]
         if media_type != b'application/x-www-form-urlencoded':
@@ -105,13 +269,30 @@ class AuthController:
                 'Expected content-type to be application/x-www-form-urlencoded'
             )
 
-        credentials = dict(parse_qsl(await text_reader(request.body)))
+        return dict(parse_qsl(await text_reader(request.body)))
 
+    async def _issue_token(
+            self,
+            request: HttpRequest,
+            credentials: Dict[str, str],
+            now: datetime
+    ) -> Tuple[str, bytes]:
+        if self.known_users is not None:
+            username = credentials.get(self.known_users.username_field)
+            if username is not None and self.known_users.is_unknown(username):
+                LOGGER.info('Authentication failed for unknown user')
+                await self.known_users.reject()
+                raise UnauthorizedError(request, 'Invalid credentials')
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
         try:
             LOGGER.debug('Authenticating')
             user_id = await self.auth_service.authenticate(**credentials)
         except (UserNotFoundError, UserCredentialsError) as error:
             LOGGER.info('Authentication failed')
+            if self.known_users is not None:
+                self.known_users.record_rejection(loop.time() - start)
             raise UnauthorizedError(request, 'Invalid credentials') from error
         except UserInvalidError as error:
             LOGGER.warning('User invalid')
@@ -119,10 +300,9 @@ class AuthController:
 
         LOGGER.info('Authenticated: %s', user_id)
 
-        authorizations = await self.auth_service.authorizations(user_id)
+        authorizations = await self._authorizations(user_id)
 
-        now = datetime.utcnow()
-        token = self.token_manager.encode(
+        token = self.token_encoder.encode(
             user_id,
             now,
             now,
@@ -130,8 +310,26 @@ class AuthController:
             authorizations=authorizations
         )
 
+        return user_id, token
+
+    async def _authenticate(self, request: HttpRequest) -> bytes:
+        credentials = await self._read_credentials(request)
+        _user_id, token = await self._issue_token(
+            request,
+            credentials,
+            datetime.utcnow()
+        )
         return token
 
+    async def _issue_client_token(
+            self,
+            request: HttpRequest,
+            credentials: Dict[str, str]
+    ) -> IssuedToken:
+        now = datetime.utcnow()
+        user_id, token = await self._issue_token(request, credentials, now)
+        return user_id, token, now + self.token_manager.lease_expiry
+
     @classmethod
     def _get_redirect(cls, request: HttpRequest) -> Optional[bytes]:
         query: Dict[bytes, bytes] = dict(
@@ -223,9 +421,80 @@ class AuthController:
 
             return HttpResponse(response_code.INTERNAL_SERVER_ERROR)
 
-    async def logout(self, _request: HttpRequest) -> HttpResponse:
+    async def client_token(self, request: HttpRequest) -> HttpResponse:
+        """Issue a token to a machine client.
+
+        The APIs read the token from the cookie named by the token manager, so
+        the response sets the cookie, and the body gives the token with the
+        cookie name for clients which manage their own cookies.
+        """
+        LOGGER.debug('Handling client token request')
+
+        try:
+            credentials = await self._read_credentials(request)
+            grant_type = credentials.pop('grant_type', None)
+            if grant_type != 'client_credentials':
+                LOGGER.debug('Invalid grant type: %s', grant_type)
+                raise BadRequestError(
+                    request,
+                    'Expected grant_type to be client_credentials'
+                )
+
+            _user_id, token, expiry = await self.client_token_cache.get(
+                credentials,
+                lambda: self._issue_client_token(request, credentials)
+            )
+
+            expires_in = int((expiry - datetime.utcnow()).total_seconds())
+            body = {
+                'access_token': token.decode('ascii'),
+                'cookie_name': self.token_manager.cookie_name.decode('ascii'),
+                'expires_in': max(expires_in, 0)
+            }
+            headers = [
+                (b'content-type', b'application/json'),
+                (b'cache-control', b'no-store'),
+                (b'set-cookie', self.token_manager.make_cookie(token))
+            ]
+
+            return HttpResponse(
+                response_code.OK,
+                headers,
+                text_writer(json.dumps(body))
+            )
+
+        except BareASGIError as error:
+
+            LOGGER.warning('Failed to issue client token: %s', error.message)
+
+            return HttpResponse(
+                error.status,
+                error.headers,
+                text_writer(error.message) if error.message else None
+            )
+
+        except:  # pylint: disable=bare-except
+
+            LOGGER.exception('Failed to issue client token')
+
+            return HttpResponse(response_code.INTERNAL_SERVER_ERROR)
+
+    async def logout(self, request: HttpRequest) -> HttpResponse:
         LOGGER.debug("Handling logout request")
 
+        token = self.token_manager.get_token_from_headers(request)
+        if token is not None:
+            try:
+                payload = self.token_manager.decode(token)
+                self.renewal_scheduler.notify(
+                    payload['sub'],
+                    'logout',
+                    {},
+                    payload['iat']
+                )
+            except jwt.exceptions.InvalidTokenError:
+                LOGGER.debug('Invalid token on logout')
+
         set_cookie = make_cookie(
             self.token_manager.cookie_name,
             b'',
@@ -239,6 +508,68 @@ class AuthController:
         ]
         return HttpResponse(response_code.NO_CONTENT, headers)
 
+    async def session_stream(self, request: HttpRequest) -> HttpResponse:
+        LOGGER.debug('Handling session stream request')
+
+        token = self.token_manager.get_token_from_headers(request)
+        if self.token_manager.get_token_status(token) not in (
+                TokenStatus.VALID,
+                TokenStatus.EXPIRED
+        ):
+            LOGGER.debug('No valid token found')
+            return HttpResponse(response_code.UNAUTHORIZED)
+
+        assert token is not None
+        payload = self.token_manager.decode(token)
+        if self._is_revoked(payload['sub'], payload['iat']):
+            LOGGER.debug('Token revoked')
+            return HttpResponse(response_code.UNAUTHORIZED)
+
+        stream = SessionStream(
+            payload['sub'],
+            payload['iat'],
+            self.stream_keepalive_interval.total_seconds()
+        )
+
+        self.renewal_scheduler.add(stream, self._renewal_delay(payload['exp']))
+
+        async def send_events():
+            try:
+                async for message in stream.events():
+                    yield message
+            finally:
+                self.renewal_scheduler.remove(stream)
+
+        headers = [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache')
+        ]
+
+        return HttpResponse(response_code.OK, headers, send_events())
+
+    def _renewal_delay(self, expiry: datetime) -> float:
+        assert self.stream_renewal_margin is not None
+        renew_at = expiry - self.stream_renewal_margin
+        return max((renew_at - datetime.utcnow()).total_seconds(), 0.0)
+
+    async def _renew_stream(self, stream: SessionStream) -> Optional[float]:
+        # The token is held in an HttpOnly cookie which the page cannot set,
+        # so rather than sending a token the client is told to renew it.
+        now = datetime.utcnow()
+
+        login_expiry = stream.issued_at + self.token_manager.session_expiry
+        if now > login_expiry:
+            stream.send('expired', {'reason': 'login expired'})
+            return None
+
+        if self._is_revoked(stream.user_id, stream.issued_at):
+            stream.send('revoked', {'reason': 'session revoked'})
+            return None
+
+        stream.send('renew', {'path': self.path_prefix + '/renew_token'})
+
+        return self._renewal_delay(now + self.token_manager.lease_expiry)
+
     async def who_am_i(self, request: HttpRequest) -> HttpResponse:
         LOGGER.debug("Handling whoami request")
 
@@ -256,11 +587,36 @@ class AuthController:
                 token = await self._renew_token(request)
 
             payload = self.token_manager.decode(token)
-            body = text_writer(json.dumps(payload, cls=JSONEncoderEx))
 
-            LOGGER.debug("Sending JWT payload: %s", payload)
+            # The expiry changes whenever the token is renewed, so it is left
+            # out of the body, which then only changes with the entity tag.
+            identity = {
+                key: value
+                for key, value in payload.items()
+                if key != 'exp'
+            }
+
+            # The identity depends on the cookie, so shared caches must not
+            # store it, and private caches must revalidate it.
+            etag = make_etag(identity)
+            headers = [
+                (b'etag', etag),
+                (b'cache-control', b'private, no-cache'),
+                (b'vary', b'Cookie')
+            ]
+            if_none_match = header.find(
+                b'if-none-match',
+                request.scope['headers']
+            )
+            if is_etag_match(if_none_match, etag):
+                LOGGER.debug('JWT payload not modified')
+                return HttpResponse(response_code.NOT_MODIFIED, headers)
+
+            body = text_writer(json.dumps(identity, cls=JSONEncoderEx))
+
+            LOGGER.debug("Sending JWT payload: %s", identity)
 
-            return HttpResponse(response_code.OK, None, body)
+            return HttpResponse(response_code.OK, headers, body)
 
         except BareASGIError as error:
             return HttpResponse(
@@ -296,8 +652,20 @@ class AuthController:
             issued_at
         )
 
-        now = datetime.utcnow()
+        return await self._reissue_token(
+            request,
+            user_id,
+            issued_at,
+            datetime.utcnow()
+        )
 
+    async def _reissue_token(
+            self,
+            request: HttpRequest,
+            user_id: str,
+            issued_at: datetime,
+            now: datetime
+    ) -> bytes:
         login_expiry = issued_at + self.token_manager.session_expiry
         if now > login_expiry:
             LOGGER.info(
@@ -308,18 +676,25 @@ class AuthController:
             )
             raise UnauthorizedError(request, 'login expired')
 
-        if not await self.auth_service.is_valid_user(user_id):
+        if self._is_revoked(user_id, issued_at):
+            LOGGER.info(
+                'Token revoked for user "%s" issued at "%s"',
+                user_id,
+                issued_at
+            )
+            raise UnauthorizedError(request, 'session revoked')
+
+        is_valid, authorizations = await self._user_state(user_id)
+        if not is_valid:
             LOGGER.warning(
                 'User "%s" is no longer valid',
                 user_id
             )
             raise ForbiddenError(request, 'invalid user')
 
-        authorizations = await self.auth_service.authorizations(user_id)
-
         # Renew the token keeping the "issued at" timestamp to ensure
         # re-authentication.
-        token = self.token_manager.encode(
+        token = self.token_encoder.encode(
             user_id,
             now,
             issued_at,
@@ -3,7 +3,8 @@ Authentication Service
 """
 
 from abc import ABCMeta, abstractmethod
-from typing import List
+from datetime import datetime
+from typing import AsyncIterable, List, Optional
 
 
 class AuthService(metaclass=ABCMeta):
@@ -43,3 +44,34 @@ class AuthService(metaclass=ABCMeta):
         Returns:
             List[str]: The authorizations.
         """
+
+    async def prepare(self) -> None:
+        """Prepare the service before the server accepts requests.
+
+        This is called at startup when the controller is created with
+        `prewarm` set, and may be overridden to open connection pools or
+        similar resources. The default implementation does nothing.
+        """
+
+    async def user_ids(
+            self,
+            since: Optional[datetime] = None
+    ) -> Optional[AsyncIterable[str]]:
+        """Enumerate the known user identifiers.
+
+        This is used to build the known users filter, and may be overridden
+        by services which can list their users. The identifiers must be the
+        usernames given to `authenticate`, after any normalisation configured
+        on the filter. The default implementation returns None, which disables
+        the filter.
+
+        Args:
+            since (Optional[datetime], optional): If given, only the users
+                created since this time are required, although returning more
+                is harmless. Defaults to None.
+
+        Returns:
+            Optional[AsyncIterable[str]]: The user identifiers, or None if they
+                cannot be enumerated.
+        """
+        return None
@@ -0,0 +1,115 @@
+"""Client Token Cache
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+import hmac
+import json
+import logging
+import secrets
+from typing import Awaitable, Callable, Dict, Mapping, Tuple
+
+LOGGER = logging.getLogger(__name__)
+
+# The user identifier, token and expiry.
+IssuedToken = Tuple[str, bytes, datetime]
+
+
+class ClientTokenCache:
+    """A cache of the tokens minted for machine clients.
+
+    Tokens are keyed by a digest of the full credentials, so a client
+    presenting different credentials never receives a cached token. Concurrent
+    requests with the same credentials share a single authentication.
+    """
+
+    def __init__(self, refresh_margin: timedelta) -> None:
+        """Initialise the client token cache.
+
+        Args:
+            refresh_margin (timedelta): A new token is minted when a cached
+                token is within this time of expiring.
+        """
+        self.refresh_margin = refresh_margin
+        self._tokens: Dict[bytes, IssuedToken] = {}
+        self._pending: Dict[bytes, 'asyncio.Future[IssuedToken]'] = {}
+        self._key = secrets.token_bytes(32)
+
+    async def get(
+            self,
+            credentials: Mapping[str, str],
+            issue: Callable[[], Awaitable[IssuedToken]]
+    ) -> IssuedToken:
+        """Get a cached token, or issue a new one.
+
+        Args:
+            credentials (Mapping[str, str]): The client credentials.
+            issue (Callable[[], Awaitable[IssuedToken]]): A function to issue a
+                new token.
+
+        Returns:
+            IssuedToken: The user identifier, token and expiry.
+        """
+        key = self._make_key(credentials)
+
+        issued_token = self._tokens.get(key)
+        if (
+                issued_token is not None and
+                issued_token[2] - self.refresh_margin > datetime.utcnow()
+        ):
+            LOGGER.debug('Using cached client token')
+            return issued_token
+
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(self._issue(key, issue))
+            self._pending[key] = pending
+
+        # Shield the shared issue from the cancellation of any one request.
+        return await asyncio.shield(pending)
+
+    def evict(self, user_id: str) -> None:
+        """Remove the cached tokens of a user.
+
+        Args:
+            user_id (str): The user identifier.
+        """
+        evicted = [
+            key
+            for key, (token_user_id, _token, _expiry) in self._tokens.items()
+            if token_user_id == user_id
+        ]
+        for key in evicted:
+            del self._tokens[key]
+
+    async def _issue(
+            self,
+            key: bytes,
+            issue: Callable[[], Awaitable[IssuedToken]]
+    ) -> IssuedToken:
+        try:
+            issued_token = await issue()
+            self._prune()
+            self._tokens[key] = issued_token
+            return issued_token
+        finally:
+            del self._pending[key]
+
+    def _prune(self) -> None:
+        now = datetime.utcnow()
+        expired = [
+            key
+            for key, (_user_id, _token, expiry) in self._tokens.items()
+            if expiry <= now
+        ]
+        for key in expired:
+            del self._tokens[key]
+
+    def _make_key(self, credentials: Mapping[str, str]) -> bytes:
+        # The credentials are keyed with a random secret for this process, so
+        # a leaked key cannot be used to recover the client secrets.
+        return hmac.new(
+            self._key,
+            json.dumps(sorted(credentials.items())).encode('utf-8'),
+            'sha256'
+        ).digest()
@@ -0,0 +1,265 @@
+"""Known Users
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+import hashlib
+import logging
+import math
+import random
+from typing import Callable, List, Optional
+
+from .auth_service import AuthService
+
+LOGGER = logging.getLogger(__name__)
+
+# The number of user ids processed before yielding to the event loop.
+CHUNK_SIZE = 1000
+
+# The weight of each new sample in the rejection time statistics.
+REJECTION_WEIGHT = 0.1
+
+
+class BloomFilter:
+    """A Bloom filter of strings"""
+
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        """Initialise the Bloom filter.
+
+        Args:
+            capacity (int): The expected number of items.
+            error_rate (float): The acceptable false positive rate.
+        """
+        capacity = max(capacity, 1)
+        self.size = max(
+            int(-capacity * math.log(error_rate) / (math.log(2) ** 2)),
+            8
+        )
+        self.hash_count = max(int(round(self.size / capacity * math.log(2))), 1)
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str) -> List[int]:
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [
+            (first + i * second) % self.size
+            for i in range(self.hash_count)
+        ]
+
+    def add(self, item: str) -> None:
+        """Add an item to the filter.
+
+        Args:
+            item (str): The item.
+        """
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(
+            self._bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(item)
+        )
+
+
+class KnownUsers:
+    """A filter of the users known to the auth service.
+
+    The filter is built in the background from `AuthService.user_ids`, then
+    users created since the last enumeration are added every
+    `refresh_interval`, and the filter is rebuilt every `rebuild_interval` to
+    drop deleted users.
+
+    Users created since the last enumeration are not in the filter, so they
+    are rejected until the next refresh unless the application which creates
+    them calls `add`. If the filter has not been refreshed within
+    `refresh_interval`, for example because the auth service is failing, no
+    user is treated as unknown.
+
+    The user identifiers from the auth service and the usernames given as
+    credentials are compared after being passed through `normalise`, so they
+    must be the same string once normalised. A backend which accepts logins in
+    other forms (for example ignoring case, or aliases) must provide a
+    normaliser which maps them to the enumerated identifier.
+
+    Until the filter is built, and until the auth service has rejected enough
+    credentials to know how long a rejection takes, every user is treated as
+    possibly known.
+    """
+
+    def __init__(
+            self,
+            auth_service: AuthService,
+            refresh_interval: timedelta,
+            rebuild_interval: timedelta,
+            username_field: str = 'username',
+            normalise: Callable[[str], str] = lambda user_id: user_id,
+            error_rate: float = 0.01,
+            baseline_rejections: int = 10
+    ) -> None:
+        """Initialise the known users filter.
+
+        Args:
+            auth_service (AuthService): The auth service.
+            refresh_interval (timedelta): How often users created since the
+                last enumeration are added.
+            rebuild_interval (timedelta): How often the filter is rebuilt.
+            username_field (str, optional): The field of the credentials
+                holding the user identifier. Defaults to 'username'.
+            normalise (Callable[[str], str], optional): A function applied to
+                both the user identifiers and the usernames. Defaults to the
+                identity.
+            error_rate (float, optional): The acceptable false positive rate.
+                Defaults to 0.01.
+            baseline_rejections (int, optional): The number of rejections by
+                the auth service which must be timed before unknown users are
+                rejected without calling it. Defaults to 10.
+        """
+        self.auth_service = auth_service
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self.username_field = username_field
+        self.normalise = normalise
+        self.error_rate = error_rate
+        self.baseline_rejections = baseline_rejections
+        self._filter: Optional[BloomFilter] = None
+        self._enumerated_at: Optional[datetime] = None
+        self._task: Optional['asyncio.Task[None]'] = None
+        self._rejection_count = 0
+        self._rejection_mean = 0.0
+        self._rejection_variance = 0.0
+
+    def is_unknown(self, username: str) -> bool:
+        """Check if a user is definitely unknown, and can be rejected without
+        calling the auth service.
+
+        Args:
+            username (str): The username from the credentials.
+
+        Returns:
+            bool: True if the user is definitely not known, the filter is up
+                to date, and the time taken by the auth service to reject
+                credentials has been measured.
+        """
+        bloom_filter = self._filter
+        enumerated_at = self._enumerated_at
+        return (
+            bloom_filter is not None and
+            enumerated_at is not None and
+            datetime.utcnow() - enumerated_at <= self.refresh_interval and
+            self._rejection_count >= self.baseline_rejections and
+            self.normalise(username) not in bloom_filter
+        )
+
+    def add(self, user_id: str) -> None:
+        """Add a user created since the filter was built.
+
+        Args:
+            user_id (str): The user identifier.
+        """
+        if self._filter is not None:
+            self._filter.add(self.normalise(user_id))
+
+    def record_rejection(self, elapsed: float) -> None:
+        """Record the time the auth service took to reject credentials.
+
+        Args:
+            elapsed (float): The time in seconds.
+        """
+        self._rejection_count += 1
+        # Exponentially weighted mean and variance, starting from the first
+        # samples so the baseline is not biased towards zero.
+        weight = max(REJECTION_WEIGHT, 1 / self._rejection_count)
+        difference = elapsed - self._rejection_mean
+        self._rejection_mean += weight * difference
+        self._rejection_variance = (1 - weight) * (
+            self._rejection_variance + weight * difference * difference
+        )
+
+    async def reject(self) -> None:
+        """Wait for as long as the auth service takes to reject credentials.
+
+        The delay is drawn from the observed distribution, so the response
+        time does not reveal which users are known.
+        """
+        deviation = math.sqrt(self._rejection_variance)
+        delay = random.gauss(self._rejection_mean, deviation)
+        delay = min(max(delay, 0.0), self._rejection_mean + 3 * deviation)
+        await asyncio.sleep(delay)
+
+    def start(self) -> None:
+        """Start maintaining the filter in the background."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop maintaining the filter."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        rebuild_at = 0.0
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                if loop.time() >= rebuild_at or self._filter is None:
+                    if not await self._build():
+                        LOGGER.info('The auth service cannot enumerate users')
+                        return
+                    rebuild_at = loop.time() + self.rebuild_interval.total_seconds()
+                else:
+                    await self._refresh()
+            except Exception:  # pylint: disable=broad-except
+                LOGGER.exception('Failed to update the known users filter')
+            await asyncio.sleep(self.refresh_interval.total_seconds())
+
+    async def _enumerate(self, since: Optional[datetime]) -> Optional[List[str]]:
+        enumerated_at = datetime.utcnow()
+        user_ids = await self.auth_service.user_ids(since)
+        if user_ids is None:
+            return None
+
+        known_user_ids: List[str] = []
+        async for user_id in user_ids:
+            known_user_ids.append(self.normalise(user_id))
+            if len(known_user_ids) % CHUNK_SIZE == 0:
+                await asyncio.sleep(0)
+
+        # The next enumeration starts from when this one started, so users
+        # created while enumerating are not missed.
+        self._enumerated_at = enumerated_at
+        return known_user_ids
+
+    async def _refresh(self) -> None:
+        bloom_filter = self._filter
+        assert bloom_filter is not None
+        known_user_ids = await self._enumerate(self._enumerated_at)
+        if not known_user_ids:
+            return
+        for index, user_id in enumerate(known_user_ids, 1):
+            bloom_filter.add(user_id)
+            if index % CHUNK_SIZE == 0:
+                await asyncio.sleep(0)
+        LOGGER.debug('Added %d users to known users filter', len(known_user_ids))
+
+    async def _build(self) -> bool:
+        known_user_ids = await self._enumerate(None)
+        if known_user_ids is None:
+            return False
+
+        # Leave room for the users added before the next rebuild.
+        bloom_filter = BloomFilter(2 * len(known_user_ids), self.error_rate)
+        for index, user_id in enumerate(known_user_ids, 1):
+            bloom_filter.add(user_id)
+            if index % CHUNK_SIZE == 0:
+                await asyncio.sleep(0)
+
+        # Replace the filter in a single assignment, so requests see either
+        # the old or the new filter.
+        self._filter = bloom_filter
+
+        LOGGER.info('Built known users filter of %d users', len(known_user_ids))
+        return True
@@ -0,0 +1,242 @@
+"""Session Streams
+"""
+
+import asyncio
+from datetime import datetime
+import heapq
+import itertools
+import json
+import logging
+from typing import (
+    Any,
+    AsyncIterable,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple
+)
+
+LOGGER = logging.getLogger(__name__)
+
+# A comment line, which clients ignore.
+KEEPALIVE = b': keepalive\n\n'
+
+
+class SessionStream:
+    """A stream of server sent events for a user session"""
+
+    def __init__(
+            self,
+            user_id: str,
+            issued_at: datetime,
+            keepalive_interval: Optional[float] = None
+    ) -> None:
+        """Initialise the session stream.
+
+        Args:
+            user_id (str): The user identifier.
+            issued_at (datetime): When the session was authenticated.
+            keepalive_interval (Optional[float], optional): If set, a comment
+                is sent when the stream has been idle for this many seconds,
+                so proxies do not close the connection. Defaults to None.
+        """
+        self.user_id = user_id
+        self.issued_at = issued_at
+        self.keepalive_interval = keepalive_interval
+        self.is_closed = False
+        self._queue: 'asyncio.Queue[Optional[bytes]]' = asyncio.Queue()
+
+    def send(self, event: str, data: Mapping[str, Any]) -> None:
+        """Queue an event for the client.
+
+        Args:
+            event (str): The event name.
+            data (Mapping[str, Any]): The event data.
+        """
+        if self.is_closed:
+            return
+        message = f'event: {event}\ndata: {json.dumps(data)}\n\n'
+        self._queue.put_nowait(message.encode('utf-8'))
+
+    def close(self) -> None:
+        """Close the stream once the queued events have been sent."""
+        if self.is_closed:
+            return
+        self.is_closed = True
+        self._queue.put_nowait(None)
+
+    async def events(self) -> AsyncIterable[bytes]:
+        """The encoded events.
+
+        Yields:
+            bytes: An encoded event.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            timer: Optional[asyncio.TimerHandle] = None
+            if self.keepalive_interval is not None and self._queue.empty():
+                timer = loop.call_later(
+                    self.keepalive_interval,
+                    self._queue.put_nowait,
+                    KEEPALIVE
+                )
+            try:
+                message = await self._queue.get()
+            finally:
+                if timer is not None:
+                    timer.cancel()
+            if message is None:
+                return
+            yield message
+
+
+class RenewalScheduler:
+    """Schedules the renewals of all the session streams.
+
+    The streams share a single heap of due times, served by one task.
+    """
+
+    def __init__(
+            self,
+            renew: Callable[[SessionStream], Awaitable[Optional[float]]]
+    ) -> None:
+        """Initialise the renewal scheduler.
+
+        Args:
+            renew (Callable[[SessionStream], Awaitable[Optional[float]]]): A
+                function to renew a stream, returning the delay in seconds
+                until the next renewal, or None if the stream was closed.
+        """
+        self.renew = renew
+        self._heap: List[Tuple[float, int, SessionStream]] = []
+        self._counter = itertools.count()
+        self._streams: Dict[str, Set[SessionStream]] = {}
+        # The event is created with the task, as before Python 3.10 it is
+        # bound to the event loop when it is created.
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional['asyncio.Task[None]'] = None
+        self._renewals: Set['asyncio.Task[None]'] = set()
+        self._is_closed = False
+
+    def add(self, stream: SessionStream, delay: float) -> None:
+        """Add a stream to be renewed.
+
+        Args:
+            stream (SessionStream): The stream.
+            delay (float): The time in seconds until the renewal.
+        """
+        self._streams.setdefault(stream.user_id, set()).add(stream)
+        self._schedule(stream, delay)
+
+    def remove(self, stream: SessionStream) -> None:
+        """Remove a stream.
+
+        The heap entry is discarded when it becomes due.
+
+        Args:
+            stream (SessionStream): The stream.
+        """
+        stream.close()
+        streams = self._streams.get(stream.user_id)
+        if streams is not None:
+            streams.discard(stream)
+            if not streams:
+                del self._streams[stream.user_id]
+
+    def notify(
+            self,
+            user_id: str,
+            event: str,
+            data: Mapping[str, Any],
+            issued_at: Optional[datetime] = None
+    ) -> None:
+        """Send an event to the streams of a user and close them.
+
+        Args:
+            user_id (str): The user identifier.
+            event (str): The event name.
+            data (Mapping[str, Any]): The event data.
+            issued_at (Optional[datetime], optional): If given only the streams
+                of this session are notified. Defaults to None.
+        """
+        for stream in list(self._streams.get(user_id, ())):
+            if issued_at is None or stream.issued_at == issued_at:
+                stream.send(event, data)
+                self.remove(stream)
+
+    async def close(self) -> None:
+        """Stop scheduling and close all the streams."""
+        self._is_closed = True
+        tasks = list(self._renewals)
+        if self._task is not None:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for streams in list(self._streams.values()):
+            for stream in list(streams):
+                self.remove(stream)
+        self._heap.clear()
+
+    def _schedule(self, stream: SessionStream, delay: float) -> None:
+        if self._is_closed:
+            stream.close()
+            return
+
+        loop = asyncio.get_running_loop()
+        entry = (loop.time() + delay, next(self._counter), stream)
+        heapq.heappush(self._heap, entry)
+
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(self._wakeup))
+        elif self._heap[0] is entry and self._wakeup is not None:
+            # The task may be sleeping until a later renewal.
+            self._wakeup.set()
+
+    async def _run(self, wakeup: asyncio.Event) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            wakeup.clear()
+
+            timer: Optional[asyncio.TimerHandle] = None
+            if self._heap:
+                due, _, stream = self._heap[0]
+                delay = due - loop.time()
+                if delay > 0:
+                    timer = loop.call_later(delay, wakeup.set)
+
+            if timer is not None or not self._heap:
+                try:
+                    await wakeup.wait()
+                finally:
+                    if timer is not None:
+                        timer.cancel()
+                continue
+
+            heapq.heappop(self._heap)
+            if stream.is_closed:
+                continue
+
+            # Renewals may call the auth service, so they must not hold up
+            # the other streams.
+            task = asyncio.create_task(self._renew(stream))
+            self._renewals.add(task)
+            task.add_done_callback(self._renewals.discard)
+
+    async def _renew(self, stream: SessionStream) -> None:
+        try:
+            delay = await self.renew(stream)
+        except Exception:  # pylint: disable=broad-except
+            LOGGER.exception('Failed to renew stream for "%s"', stream.user_id)
+            delay = None
+
+        if delay is None:
+            self.remove(stream)
+        elif not stream.is_closed:
+            self._schedule(stream, delay)
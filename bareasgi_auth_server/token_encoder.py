@@ -0,0 +1,91 @@
+"""Token Encoder
+"""
+
+from base64 import urlsafe_b64encode
+from calendar import timegm
+from datetime import datetime, timedelta
+import hashlib
+import hmac
+from json import JSONEncoder
+import logging
+from typing import Optional
+
+from bareasgi_auth_common import TokenManager
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _base64url_encode(data: bytes) -> bytes:
+    return urlsafe_b64encode(data).replace(b'=', b'')
+
+
+class TokenEncoder:
+    """A JSON web token encoder.
+
+    This produces the same HS256 tokens as `TokenManager.encode`, which is the
+    only algorithm `TokenManager.decode` accepts, but the header segment and
+    the keyed HMAC state are prepared once, rather than on every call.
+    """
+
+    def __init__(self, token_manager: TokenManager) -> None:
+        """Initialise the token encoder.
+
+        Args:
+            token_manager (TokenManager): The token manager providing the
+                secret, issuer and lease expiry.
+        """
+        self.token_manager = token_manager
+
+        # The same serialisation as PyJWT, which sorts the header keys.
+        self._json_encoder = JSONEncoder(separators=(',', ':'))
+        header = JSONEncoder(separators=(',', ':'), sort_keys=True).encode(
+            {'typ': 'JWT', 'alg': 'HS256'}
+        )
+        self._header_segment = _base64url_encode(header.encode('utf-8')) + b'.'
+        self._hmac = hmac.new(
+            token_manager.secret.encode('utf-8'),
+            digestmod=hashlib.sha256
+        )
+
+    def encode(
+            self,
+            user: str,
+            now: datetime,
+            issued_at: datetime,
+            lease_expiry: Optional[timedelta],
+            **kwargs
+    ) -> bytes:
+        """Encode the JSON web token.
+
+        Args:
+            user (str): The user identification
+            now (datetime): The current time
+            issued_at (datetime): When the token was originally issued
+            lease_expiry (Optional[timedelta]): An optional expiry.
+
+        Returns:
+            bytes: The information encoded as a JSON web token.
+        """
+        if lease_expiry is None:
+            lease_expiry = self.token_manager.lease_expiry
+        expiry = now + lease_expiry
+        LOGGER.debug("Token will expire at %s", expiry)
+        payload = {
+            'iss': self.token_manager.issuer,
+            'sub': user,
+            'exp': timegm(expiry.utctimetuple()),
+            'iat': timegm(issued_at.utctimetuple())
+        }
+        if kwargs:
+            payload.update(kwargs)
+            for time_claim in ('exp', 'iat', 'nbf'):
+                value = payload.get(time_claim)
+                if isinstance(value, datetime):
+                    payload[time_claim] = timegm(value.utctimetuple())
+
+        signing_input = self._header_segment + _base64url_encode(
+            self._json_encoder.encode(payload).encode('utf-8')
+        )
+        signer = self._hmac.copy()
+        signer.update(signing_input)
+        return signing_input + b'.' + _base64url_encode(signer.digest())
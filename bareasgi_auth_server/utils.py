@@ -1,7 +1,9 @@
 """Utilities"""
 
 from datetime import datetime, timezone
+import hashlib
 from json import JSONEncoder
+from typing import Any, Mapping, Optional
 
 
 class JSONEncoderEx(JSONEncoder):
@@ -10,3 +12,43 @@ class JSONEncoderEx(JSONEncoder):
         if isinstance(o, datetime):
             return o.astimezone(timezone.utc).isoformat()
         return JSONEncoder.default(self, o)
+
+
+def make_etag(payload: Mapping[str, Any]) -> bytes:
+    """Make an entity tag for the identity in a token payload.
+
+    Args:
+        payload (Mapping[str, Any]): The decoded token payload.
+
+    Returns:
+        bytes: A strong entity tag derived from the subject, the time the
+            session was issued, and the authorizations.
+    """
+    identity = repr((
+        payload['sub'],
+        payload['iat'].isoformat(),
+        payload.get('authorizations')
+    ))
+    digest = hashlib.sha256(identity.encode('utf-8')).hexdigest()[:32]
+    return b'"' + digest.encode('ascii') + b'"'
+
+
+def is_etag_match(if_none_match: Optional[bytes], etag: bytes) -> bool:
+    """Check if an entity tag matches an If-None-Match header.
+
+    Args:
+        if_none_match (Optional[bytes]): The header value, if any.
+        etag (bytes): The entity tag.
+
+    Returns:
+        bool: True if the entity tag matches.
+    """
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == b'*':
+        return True
+    # The weak comparison function is used for If-None-Match.
+    return any(
+        candidate.strip().replace(b'W/', b'', 1) == etag
+        for candidate in if_none_match.split(b',')
+    )
@@ -0,0 +1,57 @@
+"""Compare the throughput of the token encoder with PyJWT
+
+Run from the root of the repository with:
+
+    python -m benchmarks.token_encoder
+"""
+
+from datetime import datetime, timedelta
+import timeit
+
+from bareasgi_auth_common import TokenManager
+
+from bareasgi_auth_server.token_encoder import TokenEncoder
+
+
+def main() -> None:
+    token_manager = TokenManager(
+        'A secret which is long enough for HMAC with SHA-256',
+        timedelta(minutes=1),
+        'example.com',
+        'bareasgi-auth',
+        'example.com',
+        '/',
+        timedelta(minutes=2)
+    )
+    token_encoder = TokenEncoder(token_manager)
+    now = datetime.utcnow()
+    authorizations = ['read', 'write']
+
+    count = 100_000
+    results = {}
+    for name, encode in (
+            ('TokenManager.encode', token_manager.encode),
+            ('TokenEncoder.encode', token_encoder.encode),
+    ):
+        elapsed = min(
+            timeit.repeat(
+                lambda: encode(
+                    'tom@example.com',
+                    now,
+                    now,
+                    None,
+                    authorizations=authorizations
+                ),
+                number=count,
+                repeat=5
+            )
+        )
+        results[name] = count / elapsed
+        print(f'{name}: {results[name]:,.0f} tokens/s')
+
+    speedup = results['TokenEncoder.encode'] / results['TokenManager.encode']
+    print(f'Speedup: {speedup:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -6,8 +6,22 @@ import Typography from '@mui/material/Typography'
 
 import DashboardRouter from '@barejs/dashboard-router'
 import { Page1, Page2, Page3 } from './pages'
+import config from './config'
+import { openSessionStream } from './sessionStream'
 
 class Site extends React.Component {
+  componentDidMount() {
+    this.closeSessionStream = openSessionStream(
+      config.sessionStreamPath,
+      config.renewTokenPath,
+      () => this.props.authRedirect()
+    )
+  }
+
+  componentWillUnmount() {
+    this.closeSessionStream()
+  }
+
   render() {
     return (
       <DashboardRouter
@@ -86,7 +100,8 @@ class Site extends React.Component {
 
 Site.propTypes = {
   authFetch: PropTypes.func.isRequired,
-  authCredentials: PropTypes.object.isRequired
+  authCredentials: PropTypes.object.isRequired,
+  authRedirect: PropTypes.func.isRequired
 }
 
 export default Site
@@ -0,0 +1,31 @@
+// Listens to the session stream of the auth server.
+//
+// The token is held in an HttpOnly cookie, so the stream never carries it.
+// Instead the server sends a "renew" event when the token is about to expire,
+// and the client renews the cookie with a single request. A "logout",
+// "revoked" or "expired" event ends the session.
+export function openSessionStream(streamPath, renewTokenPath, onSessionEnded) {
+  const eventSource = new EventSource(streamPath, { withCredentials: true })
+
+  eventSource.addEventListener('renew', () => {
+    fetch(renewTokenPath, { method: 'POST', credentials: 'include' })
+      .then(response => {
+        if (response.status !== 204) {
+          throw Error('renew failed')
+        }
+      })
+      .catch(error => {
+        eventSource.close()
+        onSessionEnded(error + '')
+      })
+  })
+
+  for (const event of ['logout', 'revoked', 'expired']) {
+    eventSource.addEventListener(event, message => {
+      eventSource.close()
+      onSessionEnded(JSON.parse(message.data).reason || event)
+    })
+  }
+
+  return () => eventSource.close()
+}
@@ -5,6 +5,9 @@ import Box from '@mui/material/Box'
 import CssBaseline from '@mui/material/CssBaseline'
 import Typography from '@mui/material/Typography'
 
+import config from './config'
+import { openSessionStream } from './sessionStream'
+
 class Site extends Component {
   state = {
     isLoaded: false,
@@ -13,6 +16,12 @@ class Site extends Component {
   }
 
   componentDidMount() {
+    this.closeSessionStream = openSessionStream(
+      config.sessionStreamPath,
+      config.renewTokenPath,
+      () => this.props.authRedirect()
+    )
+
     this.props
       .authFetch(`${window.location.origin}/example/api/hello`)
       .then(response => {
@@ -32,6 +41,10 @@ class Site extends Component {
       })
   }
 
+  componentWillUnmount() {
+    this.closeSessionStream()
+  }
+
   render() {
     const { isLoaded, isError, text } = this.state
 
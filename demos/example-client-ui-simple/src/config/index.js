@@ -1,6 +1,8 @@
 const config = {
   whoamiPath: '/auth/api/whoami',
-  loginPath: '/auth/ui/login'
+  loginPath: '/auth/ui/login',
+  sessionStreamPath: '/auth/api/session/stream',
+  renewTokenPath: '/auth/api/renew_token'
 }
 
 export default config
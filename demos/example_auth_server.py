@@ -1,19 +1,21 @@
 """Example Auth server"""
 
 import asyncio
-from datetime import timedelta
+from datetime import datetime, timedelta
 import logging
 import logging.config
 import socket
-from typing import List, Any, Dict
+from typing import AsyncIterable, Callable, List, Any, Dict, Optional
 
 from hypercorn.asyncio import serve
 from hypercorn.config import Config
 from bareasgi import Application
 from bareasgi_auth_common import TokenManager
 from bareasgi_auth_server import (
+    AuthCache,
     AuthController,
     AuthService,
+    KnownUsers,
     UserNotFoundError,
     UserCredentialsError,
     UserInvalidError
@@ -31,6 +33,8 @@ def getdomainname() -> str:
 class MockAuthService(AuthService):
 
     def __init__(self) -> None:
+        self.created: Dict[str, datetime] = {}
+        self.on_user_created: List[Callable[[str], None]] = []
         self.users: Dict[str, Any] = {
             'tom@example.com': {
                 'password': 'foo',
@@ -57,6 +61,23 @@ class MockAuthService(AuthService):
             }
         }
 
+    def create_user(
+            self,
+            user_id: str,
+            password: str,
+            authorizations: List[str]
+    ) -> None:
+        self.users[user_id] = {
+            'password': password,
+            'is_valid': True,
+            'authorizations': authorizations
+        }
+        self.created[user_id] = datetime.utcnow()
+        # The known users filter would otherwise reject the new user until
+        # its next refresh.
+        for callback in self.on_user_created:
+            callback(user_id)
+
     async def authenticate(self, **credentials) -> str:
         user_id = credentials['username']
         user = self.users.get(user_id)
@@ -80,6 +101,17 @@ class MockAuthService(AuthService):
             return []
         return user['authorizations']
 
+    async def user_ids(
+            self,
+            since: Optional[datetime] = None
+    ) -> Optional[AsyncIterable[str]]:
+        async def enumerate_user_ids():
+            for user_id in list(self.users):
+                created = self.created.get(user_id)
+                if since is None or (created is not None and created >= since):
+                    yield user_id
+        return enumerate_user_ids()
+
 
 async def main_async():
     LOGGER.debug('Starting server')
@@ -99,10 +131,20 @@ async def main_async():
         '/',
         session_expiry
     )
+    auth_service = MockAuthService()
+    known_users = KnownUsers(
+        auth_service,
+        timedelta(seconds=10),
+        timedelta(minutes=5)
+    )
+    auth_service.on_user_created.append(known_users.add)
     auth_controller = AuthController(
         '/auth/api',
         token_manager,
-        MockAuthService()
+        auth_service,
+        AuthCache(lease_expiry, 'auth-cache.snapshot'),
+        stream_renewal_margin=timedelta(seconds=10),
+        known_users=known_users
     )
     auth_controller.add_routes(app)
 
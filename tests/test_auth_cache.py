@@ -0,0 +1,115 @@
+"""Tests for the authentication cache"""
+
+from datetime import timedelta
+import time
+
+from bareasgi_auth_server.auth_cache import AuthCache
+
+
+def test_get_set():
+    """Test entries are returned until they expire"""
+    cache = AuthCache(timedelta(minutes=1))
+    assert cache.get('tom') is None
+    cache.set('tom', True, ['read'])
+    assert cache.get('tom') == (True, ['read'])
+    cache.discard('tom')
+    assert cache.get('tom') is None
+
+    cache = AuthCache(timedelta(seconds=-1))
+    cache.set('tom', True, ['read'])
+    assert cache.get('tom') is None
+
+
+def test_snapshot(tmp_path):
+    """Test the cache survives a restart"""
+    snapshot_path = str(tmp_path / 'auth-cache.snapshot')
+
+    cache = AuthCache(timedelta(minutes=1), snapshot_path)
+    cache.load()
+    cache.set('tom', True, ['read', 'write'])
+    cache.set('harry', False, [])
+    cache.save()
+
+    cache = AuthCache(timedelta(minutes=1), snapshot_path)
+    cache.load()
+    cache.set('harry', True, ['read'])
+    assert cache.get('tom') == (True, ['read', 'write'])
+    assert cache.get('harry') == (True, ['read'])
+    assert cache.get('dick') is None
+
+
+def test_snapshot_expiry(tmp_path, monkeypatch):
+    """Test entries which expire while the server is down are dropped"""
+    snapshot_path = str(tmp_path / 'auth-cache.snapshot')
+
+    cache = AuthCache(timedelta(minutes=1), snapshot_path)
+    cache.set('tom', True, ['read'])
+    cache.save()
+
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 120)
+    cache = AuthCache(timedelta(minutes=1), snapshot_path)
+    cache.load()
+    assert cache.get('tom') is None
+    cache.save()
+    monkeypatch.undo()
+
+    cache = AuthCache(timedelta(minutes=1), snapshot_path)
+    cache.load()
+    assert cache.get('tom') is None
+
+
+def test_snapshot_lookup(tmp_path):
+    """Test entries are found in a snapshot of many users"""
+    snapshot_path = str(tmp_path / 'auth-cache.snapshot')
+
+    cache = AuthCache(timedelta(minutes=1), snapshot_path)
+    for index in range(1000):
+        cache.set(f'user{index}', index % 2 == 0, [str(index)])
+    cache.save()
+
+    cache = AuthCache(timedelta(minutes=1), snapshot_path)
+    cache.load()
+    cache.discard('user2')
+    assert cache.get('user2') is None
+    assert all(
+        cache.get(f'user{index}') == (index % 2 == 0, [str(index)])
+        for index in range(3, 1000)
+    )
+    assert cache.get('user1000') is None
+    cache.save()
+
+    cache = AuthCache(timedelta(minutes=1), snapshot_path)
+    cache.load()
+    assert cache.get('user2') is None
+    assert cache.get('user0') == (True, ['0'])
+    assert not [
+        path
+        for path in tmp_path.iterdir()
+        if path.name.startswith('.auth-cache-')
+    ]
+
+
+def test_snapshot_workers(tmp_path):
+    """Test the entries of workers sharing a snapshot are merged"""
+    snapshot_path = str(tmp_path / 'auth-cache.snapshot')
+
+    cache = AuthCache(timedelta(minutes=1), snapshot_path)
+    cache.set('tom', True, ['read'])
+    cache.save()
+
+    worker1 = AuthCache(timedelta(minutes=1), snapshot_path)
+    worker2 = AuthCache(timedelta(minutes=1), snapshot_path)
+    worker1.load()
+    worker2.load()
+    worker1.set('alice', True, ['read'])
+    worker2.set('bob', True, ['write'])
+    worker2.discard('tom')
+    worker1.save()
+    worker2.save()
+
+    cache = AuthCache(timedelta(minutes=1), snapshot_path)
+    cache.load()
+    assert cache.get('alice') == (True, ['read'])
+    assert cache.get('bob') == (True, ['write'])
+    assert cache.get('tom') is None
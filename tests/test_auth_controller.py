@@ -0,0 +1,222 @@
+"""Tests for the authentication controller"""
+
+import asyncio
+from datetime import datetime, timedelta
+import json
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from bareasgi import Application
+from bareasgi_auth_common import TokenManager
+
+from bareasgi_auth_server.auth_cache import AuthCache
+from bareasgi_auth_server.auth_controller import AuthController
+from bareasgi_auth_server.auth_service import AuthService
+from bareasgi_auth_server.types import UserNotFoundError
+
+Headers = Sequence[Tuple[bytes, bytes]]
+
+
+class MockAuthService(AuthService):
+
+    async def authenticate(self, **credentials) -> str:
+        if credentials.get('password') != 'secret':
+            raise UserNotFoundError()
+        return credentials['username']
+
+    async def is_valid_user(self, user_id: str) -> bool:
+        return True
+
+    async def authorizations(self, user_id: str) -> List[str]:
+        return ['read']
+
+
+def _make_controller(auth_cache: Optional[AuthCache] = None) -> AuthController:
+    token_manager = TokenManager(
+        'a secret of at least thirty two bytes',
+        timedelta(minutes=1),
+        'test',
+        'test-auth',
+        'localhost',
+        '/',
+        timedelta(hours=1)
+    )
+    return AuthController(
+        '/auth',
+        token_manager,
+        MockAuthService(),
+        auth_cache
+    )
+
+
+async def _call(
+        app: Application,
+        method: str,
+        path: str,
+        headers: Headers = (),
+        body: bytes = b''
+) -> Tuple[int, Dict[bytes, bytes], bytes]:
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': b'',
+        'root_path': '',
+        'headers': [(b'host', b'localhost')] + list(headers),
+        'server': ('localhost', 80),
+        'client': ('localhost', 10000),
+    }
+    messages: List[dict] = []
+    is_received = False
+    is_complete = asyncio.Event()
+
+    async def receive():
+        nonlocal is_received
+        if not is_received:
+            is_received = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        await is_complete.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        messages.append(message)
+        if (
+                message['type'] == 'http.response.body' and
+                not message.get('more_body', False)
+        ):
+            is_complete.set()
+
+    await app(scope, receive, send)
+    start, *rest = messages
+    return (
+        start['status'],
+        dict(start['headers']),
+        b''.join(message.get('body', b'') for message in rest)
+    )
+
+
+async def _login(app: Application, user_id: str) -> bytes:
+    status, headers, _body = await _call(
+        app,
+        'POST',
+        '/auth/authenticate',
+        [(b'content-type', b'application/x-www-form-urlencoded')],
+        f'username={user_id}&password=secret'.encode()
+    )
+    assert status == 302
+    return headers[b'set-cookie'].split(b';')[0]
+
+
+def test_revocation_survives_restart(tmp_path):
+    """Test a revocation saved in the snapshot refuses renewal after a restart"""
+    snapshot_path = str(tmp_path / 'auth-cache.snapshot')
+
+    async def run():
+        controller = _make_controller(
+            AuthCache(timedelta(minutes=1), snapshot_path)
+        )
+        app = controller.add_routes(Application())
+        await controller.on_startup(None)
+        cookie = await _login(app, 'tom')
+        # Tokens issued in the second of the revocation are not revoked.
+        await asyncio.sleep(1.1 - datetime.utcnow().microsecond / 1e6)
+        controller.revoke('tom')
+        await controller.on_shutdown(None)
+
+        controller = _make_controller(
+            AuthCache(timedelta(minutes=1), snapshot_path)
+        )
+        app = controller.add_routes(Application())
+        await controller.on_startup(None)
+        status, _headers, body = await _call(
+            app,
+            'POST',
+            '/auth/renew_token',
+            [(b'cookie', cookie)]
+        )
+        assert status == 401
+        assert body == b'session revoked'
+        await controller.on_shutdown(None)
+
+    asyncio.run(run())
+
+
+def test_revocation_granularity():
+    """Test a login in the second of the revocation is not revoked"""
+
+    async def run():
+        controller = _make_controller()
+        app = controller.add_routes(Application())
+        controller.revoke('tom')
+        cookie = await _login(app, 'tom')
+        status, _headers, _body = await _call(
+            app,
+            'POST',
+            '/auth/renew_token',
+            [(b'cookie', cookie)]
+        )
+        assert status == 204
+
+    asyncio.run(run())
+
+    controller = _make_controller()
+    controller.revoke('tom')
+    revoked_at, _expires = controller._revocations['tom']  # pylint: disable=protected-access
+    revoked_at_time = datetime.utcfromtimestamp(revoked_at)
+    assert controller._is_revoked(  # pylint: disable=protected-access
+        'tom',
+        revoked_at_time - timedelta(seconds=1)
+    )
+    assert not controller._is_revoked(  # pylint: disable=protected-access
+        'tom',
+        revoked_at_time
+    )
+
+
+def test_who_am_i_etag():
+    """Test whoami answers a matching If-None-Match with not modified"""
+
+    async def run():
+        controller = _make_controller()
+        app = controller.add_routes(Application())
+        cookie = await _login(app, 'tom')
+
+        status, headers, body = await _call(
+            app,
+            'GET',
+            '/auth/whoami',
+            [(b'cookie', cookie)]
+        )
+        assert status == 200
+        assert headers[b'cache-control'] == b'private, no-cache'
+        assert headers[b'vary'] == b'Cookie'
+        identity = json.loads(body)
+        assert identity['sub'] == 'tom'
+        assert 'exp' not in identity
+        etag = headers[b'etag']
+
+        status, headers, body = await _call(
+            app,
+            'GET',
+            '/auth/whoami',
+            [(b'cookie', cookie), (b'if-none-match', etag)]
+        )
+        assert status == 304
+        assert body == b''
+        assert headers[b'etag'] == etag
+        assert headers[b'cache-control'] == b'private, no-cache'
+        assert headers[b'vary'] == b'Cookie'
+
+        status, headers, body = await _call(
+            app,
+            'GET',
+            '/auth/whoami',
+            [(b'cookie', cookie), (b'if-none-match', b'"other"')]
+        )
+        assert status == 200
+        assert json.loads(body) == identity
+
+    asyncio.run(run())
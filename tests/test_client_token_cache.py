@@ -0,0 +1,76 @@
+"""Tests for the client token cache"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+from bareasgi_auth_server.client_token_cache import ClientTokenCache
+
+
+def test_shared_issue():
+    """Test concurrent and repeated requests share an issued token"""
+    cache = ClientTokenCache(timedelta(seconds=10))
+    issued = []
+
+    async def issue():
+        await asyncio.sleep(0.01)
+        issued.append(None)
+        return 'service', f'token{len(issued)}'.encode(), datetime.utcnow() + timedelta(minutes=1)
+
+    async def run():
+        credentials = {'username': 'service', 'password': 'secret'}
+        tokens = await asyncio.gather(*[
+            cache.get(credentials, issue)
+            for _ in range(10)
+        ])
+        assert {token for _user_id, token, _expiry in tokens} == {b'token1'}
+        _user_id, token, _expiry = await cache.get(dict(credentials), issue)
+        assert token == b'token1'
+
+        _user_id, token, _expiry = await cache.get(
+            {'username': 'service', 'password': 'wrong'},
+            issue
+        )
+        assert token == b'token2'
+
+    asyncio.run(run())
+    assert len(issued) == 2
+
+
+def test_refresh_near_expiry():
+    """Test a token is reissued when it is close to expiry"""
+    cache = ClientTokenCache(timedelta(minutes=2))
+    issued = []
+
+    async def issue():
+        issued.append(None)
+        return 'service', f'token{len(issued)}'.encode(), datetime.utcnow() + timedelta(minutes=1)
+
+    async def run():
+        _user_id, token, _expiry = await cache.get({'username': 'service'}, issue)
+        assert token == b'token1'
+        _user_id, token, _expiry = await cache.get({'username': 'service'}, issue)
+        assert token == b'token2'
+
+    asyncio.run(run())
+    assert len(issued) == 2
+
+
+def test_evict():
+    """Test the tokens of a user can be evicted"""
+    cache = ClientTokenCache(timedelta(seconds=10))
+    issued = []
+
+    async def issue():
+        issued.append(None)
+        return 'service', f'token{len(issued)}'.encode(), datetime.utcnow() + timedelta(minutes=1)
+
+    async def run():
+        await cache.get({'username': 'service'}, issue)
+        cache.evict('other')
+        _user_id, token, _expiry = await cache.get({'username': 'service'}, issue)
+        assert token == b'token1'
+        cache.evict('service')
+        _user_id, token, _expiry = await cache.get({'username': 'service'}, issue)
+        assert token == b'token2'
+
+    asyncio.run(run())
@@ -0,0 +1,139 @@
+"""Tests for the known users filter"""
+
+import asyncio
+from datetime import datetime, timedelta
+from typing import AsyncIterable, List, Optional
+
+from bareasgi_auth_server import AuthService
+from bareasgi_auth_server.known_users import BloomFilter, KnownUsers
+
+
+class EnumerableAuthService(AuthService):
+
+    def __init__(self, users: List[str]) -> None:
+        self.users = users
+        self.since: List[Optional[datetime]] = []
+
+    async def authenticate(self, **credentials) -> str:
+        return credentials['username']
+
+    async def is_valid_user(self, user_id: str) -> bool:
+        return user_id in self.users
+
+    async def authorizations(self, user_id: str) -> List[str]:
+        return []
+
+    async def user_ids(
+            self,
+            since: Optional[datetime] = None
+    ) -> Optional[AsyncIterable[str]]:
+        self.since.append(since)
+        users = list(self.users)
+
+        async def enumerate_user_ids():
+            for user_id in users:
+                yield user_id
+        return enumerate_user_ids()
+
+
+def test_bloom_filter():
+    """Test the filter has no false negatives and few false positives"""
+    bloom_filter = BloomFilter(5000, 0.01)
+    for index in range(5000):
+        bloom_filter.add(f'user{index}@example.com')
+
+    assert all(
+        f'user{index}@example.com' in bloom_filter
+        for index in range(5000)
+    )
+    false_positives = sum(
+        f'other{index}@example.com' in bloom_filter
+        for index in range(5000)
+    )
+    assert false_positives < 150
+
+
+def test_known_users():
+    """Test the filter is built and refreshed"""
+    auth_service = EnumerableAuthService(
+        [f'User{index}@example.com' for index in range(2500)]
+    )
+    known_users = KnownUsers(
+        auth_service,
+        timedelta(minutes=1),
+        timedelta(minutes=5),
+        normalise=str.lower,
+        baseline_rejections=2
+    )
+
+    async def run():
+        assert await known_users._build()  # pylint: disable=protected-access
+
+        # Unknown users are not rejected until there is a timing baseline.
+        assert not known_users.is_unknown('nobody@example.com')
+        known_users.record_rejection(0.01)
+        known_users.record_rejection(0.03)
+        assert known_users.is_unknown('nobody@example.com')
+        assert not known_users.is_unknown('user42@EXAMPLE.com')
+
+        known_users.add('Added@example.com')
+        assert not known_users.is_unknown('added@example.com')
+
+        auth_service.users = ['New@example.com']
+        assert known_users.is_unknown('new@example.com')
+        await known_users._refresh()  # pylint: disable=protected-access
+        assert not known_users.is_unknown('new@example.com')
+        assert auth_service.since[0] is None
+        assert auth_service.since[1] is not None
+
+        # Misses are not trusted once the filter is out of date.
+        known_users._enumerated_at -= timedelta(minutes=2)  # pylint: disable=protected-access
+        assert not known_users.is_unknown('nobody@example.com')
+
+    asyncio.run(run())
+
+
+def test_known_users_background():
+    """Test the filter is built in the background"""
+    known_users = KnownUsers(
+        EnumerableAuthService(['tom@example.com']),
+        timedelta(minutes=1),
+        timedelta(minutes=5),
+        baseline_rejections=0
+    )
+
+    async def run():
+        known_users.start()
+        while not known_users.is_unknown('nobody@example.com'):
+            await asyncio.sleep(0)
+        assert not known_users.is_unknown('tom@example.com')
+        await known_users.stop()
+
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_rejection_delay(monkeypatch):
+    """Test the rejection delay follows the observed distribution"""
+    known_users = KnownUsers(
+        EnumerableAuthService([]),
+        timedelta(minutes=1),
+        timedelta(minutes=5)
+    )
+    for elapsed in (0.01, 0.02, 0.03) * 10:
+        known_users.record_rejection(elapsed)
+
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(asyncio, 'sleep', sleep)
+
+    async def run():
+        for _ in range(200):
+            await known_users.reject()
+
+    asyncio.run(run())
+    monkeypatch.undo()
+    assert 0.015 < sum(delays) / len(delays) < 0.025
+    assert len(set(delays)) > 100
@@ -0,0 +1,83 @@
+"""Tests for the session streams"""
+
+import asyncio
+from datetime import datetime
+from typing import Optional
+
+from bareasgi_auth_server.session_stream import RenewalScheduler, SessionStream
+
+
+def test_renewal_scheduler():
+    """Test streams are renewed in order and notified on logout"""
+    renewed = []
+
+    async def renew(stream: SessionStream) -> Optional[float]:
+        renewed.append(stream.user_id)
+        stream.send('token', {'user_id': stream.user_id})
+        return 10
+
+    async def run():
+        scheduler = RenewalScheduler(renew)
+        issued_at = datetime.utcnow()
+        tom = SessionStream('tom', issued_at)
+        dick = SessionStream('dick', issued_at)
+        scheduler.add(tom, 0.05)
+        scheduler.add(dick, 0.01)
+
+        await asyncio.sleep(0.1)
+        assert renewed == ['dick', 'tom']
+
+        scheduler.notify('tom', 'logout', {}, issued_at)
+        assert tom.is_closed and not dick.is_closed
+        events = [event async for event in tom.events()]
+        assert events == [
+            b'event: token\ndata: {"user_id": "tom"}\n\n',
+            b'event: logout\ndata: {}\n\n'
+        ]
+
+        await scheduler.close()
+        assert dick.is_closed
+
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_close_during_renewal():
+    """Test closing cancels renewals and stops scheduling"""
+    started = asyncio.Event()
+
+    async def renew(_stream: SessionStream) -> Optional[float]:
+        started.set()
+        await asyncio.sleep(10)
+        return 10
+
+    async def run():
+        scheduler = RenewalScheduler(renew)
+        stream = SessionStream('tom', datetime.utcnow())
+        scheduler.add(stream, 0)
+        await started.wait()
+
+        await scheduler.close()
+        assert stream.is_closed
+        assert not scheduler._renewals  # pylint: disable=protected-access
+
+        scheduler.add(SessionStream('dick', datetime.utcnow()), 0)
+        assert scheduler._task is None  # pylint: disable=protected-access
+
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_keepalive():
+    """Test an idle stream sends keepalive comments"""
+
+    async def run():
+        stream = SessionStream('tom', datetime.utcnow(), 0.01)
+        events = stream.events().__aiter__()
+        assert await events.__anext__() == b': keepalive\n\n'
+
+        stream.send('renew', {})
+        stream.close()
+        assert [event async for event in events] == [
+            b'event: renew\ndata: {}\n\n'
+        ]
+
+    asyncio.run(asyncio.wait_for(run(), 5))
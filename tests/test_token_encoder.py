@@ -0,0 +1,73 @@
+"""Tests for the token encoder"""
+
+from datetime import datetime, timedelta
+
+from bareasgi_auth_common import TokenManager
+import jwt
+
+from bareasgi_auth_server.token_encoder import TokenEncoder
+
+
+def _make_token_manager() -> TokenManager:
+    return TokenManager(
+        'A secret which is long enough for HMAC with SHA-256',
+        timedelta(minutes=1),
+        'example.com',
+        'bareasgi-auth',
+        'example.com',
+        '/',
+        timedelta(minutes=2)
+    )
+
+
+def test_matches_pyjwt():
+    """Test the encoder produces the same tokens as PyJWT"""
+    token_manager = _make_token_manager()
+    token_encoder = TokenEncoder(token_manager)
+
+    now = datetime(2021, 10, 31, 12, 30, 15)
+    issued_at = now - timedelta(seconds=45)
+    for user, lease_expiry, kwargs in [
+            ('tom@example.com', None, {}),
+            ('dick@example.com', timedelta(hours=1), {'authorizations': []}),
+            ('hárry', None, {'authorizations': ['read', 'write']}),
+    ]:
+        expected = token_manager.encode(
+            user,
+            now,
+            issued_at,
+            lease_expiry,
+            **kwargs
+        )
+        actual = token_encoder.encode(
+            user,
+            now,
+            issued_at,
+            lease_expiry,
+            **kwargs
+        )
+        assert actual == expected
+
+        payload = token_manager.decode(actual)
+        assert payload['sub'] == user
+        assert payload['iat'] == issued_at
+
+
+def test_verified_by_pyjwt():
+    """Test the tokens can be verified by PyJWT"""
+    token_manager = _make_token_manager()
+    now = datetime.utcnow()
+    token = TokenEncoder(token_manager).encode(
+        'tom@example.com',
+        now,
+        now,
+        None,
+        authorizations=['read']
+    )
+    payload = jwt.decode(
+        token,
+        key=token_manager.secret,
+        algorithms=['HS256']
+    )
+    assert payload['sub'] == 'tom@example.com'
+    assert payload['authorizations'] == ['read']
@@ -0,0 +1,26 @@
+"""Tests for the utilities"""
+
+from datetime import datetime
+
+from bareasgi_auth_server.utils import is_etag_match, make_etag
+
+
+def test_etag():
+    """Test entity tags depend on the identity and match If-None-Match"""
+    issued_at = datetime(2021, 10, 31, 12, 30)
+    payload = {
+        'sub': 'tom@example.com',
+        'iat': issued_at,
+        'exp': datetime(2021, 10, 31, 12, 31),
+        'authorizations': ['read']
+    }
+    etag = make_etag(payload)
+    assert etag.startswith(b'"') and etag.endswith(b'"')
+    assert make_etag({**payload, 'exp': datetime(2021, 10, 31, 12, 32)}) == etag
+    assert make_etag({**payload, 'authorizations': ['read', 'write']}) != etag
+
+    assert not is_etag_match(None, etag)
+    assert is_etag_match(etag, etag)
+    assert is_etag_match(b'"other", W/' + etag, etag)
+    assert is_etag_match(b'*', etag)
+    assert not is_etag_match(b'"other"', etag)